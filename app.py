@@ -7,54 +7,66 @@ This version provides two data loading options: uploading custom files or
 using a pre-packaged sample dataset for a quick demonstration.
 """
 
+import copy
+
 import streamlit as st
-import pandas as pd
 
-from dispute_assistant import ui, core, agent
+from dispute_assistant import ui, core
 
 # --- Page Configuration ---
 st.set_page_config(page_title="AI Dispute Assistant", page_icon="🤖", layout="wide")
 
-# --- Helper Function for Analysis ---
-def run_analysis(disputes_data, transactions_data):
-    """A helper function to run the core analysis and set the session state."""
-    with st.spinner("Analyzing disputes... This may take a moment."):
-        try:
-            classified_df, resolutions_df = core.process_files(disputes_data, transactions_data)
-            unified_df = pd.merge(classified_df, resolutions_df, on='dispute_id')
-            
-            st.session_state['classified_df'] = classified_df
-            st.session_state['resolutions_df'] = resolutions_df
-            st.session_state['unified_df'] = unified_df
-            st.session_state['agent_executor'] = agent.get_agent_executor(unified_df)
-            st.session_state.messages = [
-                {"role": "assistant", "content": "Analysis complete! How can I help you with the dispute data?"}
-            ]
-            st.session_state.active_view = "Analysis"
-            
-        except Exception as e:
-            st.error(f"An error occurred during processing: {e}")
-            st.session_state['unified_df'] = None
+# --- View Fragments ---
+# Each view is a fragment, so interacting with it reruns only that view
+# instead of the whole script.
+@st.fragment
+def analysis_view():
+    """Renders the results tables, downloads and trends chart."""
+    ui.display_results(st.session_state['classified_df'], st.session_state['resolutions_df'])
+
+
+@st.fragment
+def chat_view():
+    """Renders the chat history and answers a new prompt with the AI agent."""
+    user_prompt = ui.build_chat_interface()
+    if user_prompt:
+        # Stream the answer straight into the chat instead of blocking until the
+        # whole agent run is done
+        with st.chat_message("assistant"), st.spinner("AI Assistant is thinking..."):
+            try:
+                from dispute_assistant import agent
+
+                agent_executor = st.session_state['agent_executor']
+                # The new prompt is already the last message; send only the turns before it
+                history = st.session_state.messages[:-1]
+                ai_response = st.write_stream(agent.astream_answer(agent_executor, user_prompt, history))
+            except Exception as e:
+                ai_response = f"Sorry, I encountered an error: {e}"
+                st.markdown(ai_response)
+        st.session_state.messages.append({"role": "assistant", "content": ai_response})
+        # Redraw just the chat so the history renders in order above the input
+        st.rerun(scope="fragment")
+
 
 # --- Main Application ---
 st.title("🤖 AI-Powered Dispute Assistant")
 
 # Initialize Session State (if not already done)
-if 'unified_df' not in st.session_state:
-    st.session_state['unified_df'] = None
-if "active_view" not in st.session_state:
-    st.session_state.active_view = "Analysis"
+# Defaults are copied so sessions never share a mutable value such as the chat history
+for key, default in ui.SESSION_DEFAULTS.items():
+    if key not in st.session_state:
+        st.session_state[key] = copy.deepcopy(default)
 
 # 1. Build the sidebar and get user actions
 disputes_file, txns_file, upload_clicked, sample_clicked = ui.build_sidebar()
 
 # 2. Handle the "Load Sample Data" action
 if sample_clicked:
-    run_analysis('data/disputes.csv', 'data/transactions.csv')
+    core.run_analysis('data/disputes.csv', 'data/transactions.csv')
 
 # 3. Handle the "Analyze Uploaded Files" action
 if upload_clicked:
-    run_analysis(disputes_file, txns_file)
+    core.run_analysis(disputes_file, txns_file)
 
 # 4. Display the main interface if data is loaded
 if st.session_state['unified_df'] is not None:
@@ -71,20 +83,9 @@ if st.session_state['unified_df'] is not None:
     st.session_state.active_view = "Analysis" if selected_view == view_options[0] else "Chatbot"
 
     if st.session_state.active_view == "Analysis":
-        ui.display_results(st.session_state['classified_df'], st.session_state['resolutions_df'])
+        analysis_view()
     
     elif st.session_state.active_view == "Chatbot":
-        user_prompt = ui.build_chat_interface()
-        if user_prompt:
-            st.session_state.active_view = "Chatbot"
-            with st.spinner("AI Assistant is thinking..."):
-                try:
-                    agent_executor = st.session_state['agent_executor']
-                    response = agent_executor.invoke({"input": user_prompt})
-                    ai_response = response['output']
-                except Exception as e:
-                    ai_response = f"Sorry, I encountered an error: {e}"
-                st.session_state.messages.append({"role": "assistant", "content": ai_response})
-                st.rerun()
+        chat_view()
 else:
     st.info("Welcome! Please use an option in the sidebar to begin analysis.")
\ No newline at end of file
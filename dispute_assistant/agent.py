@@ -7,45 +7,141 @@ This module is responsible for creating and configuring the LangChain agent
 that allows for a conversational experience with the processed dispute data.
 This version includes a custom prompt to give the agent a better persona
 and allow it to handle conversational greetings gracefully.
+
+The LangChain and Gemini packages are imported inside the builder functions,
+so importing this module is cheap and analysis-only sessions never load them.
 """
 
+import os
+
 import streamlit as st
 import pandas as pd
 from textwrap import dedent
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain.agents.agent_types import AgentType
 from datetime import datetime
+
+# Upper bound on concurrent tool calls / LLM requests within one agent run or batch
+AGENT_MAX_CONCURRENCY = 4
+
+# Set DEBUG_AGENT=1 to trace agent runs with LangChain's tracer. Off by default, so
+# production runs pay no per-step logging cost.
+DEBUG_AGENT = os.environ.get("DEBUG_AGENT") == "1"
+
+# Number of most recent chat messages passed along with each question. A fixed window
+# keeps the prompt size constant however long the conversation gets.
+CHAT_HISTORY_WINDOW = 6
+
 # --- Custom Prompt Engineering ---
 # This is the new set of instructions for our agent.
-TODAY = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+# The agent uses native function calling, so this prefix is sent as the system message.
+# The current date is not part of it: it is sent with every question (see `_agent_input`),
+# so a long-lived cached agent never answers with the day it was built.
+MODEL_NAME = "gemini-2.5-flash"
 
-AGENT_PREFIX = dedent(f"""
+AGENT_PREFIX = dedent("""
     You are a friendly and highly skilled AI data assistant working with a pandas DataFrame.
     Your name is "DisputeBot".
 
     Here are your instructions:
     1.  You are working with a DataFrame named `df`.
     2.  When the user asks a question about the data, you MUST use the `python_repl_ast` tool to find the answer.
-    3.  Your thought process should be clear and methodical. First, think about what you need to do. Then, write and execute the code.
-    4.  **IMPORTANT**: If the user's input is a greeting, a simple question (like "who are you?"), or conversational, you should NOT use the `python_repl_ast` tool. Instead, you should respond directly with a friendly, conversational answer in the "Final Answer" format.
+    3.  Be clear and methodical. First, work out what you need to compute. Then, write and execute the code in as few tool calls as possible.
+    4.  **IMPORTANT**: If the user's input is a greeting, a simple question (like "who are you?"), or conversational, you should NOT use the `python_repl_ast` tool. Instead, you should respond directly with a friendly, conversational answer.
     5.  Your responses should be helpful, polite, and easy to understand.
     6.  When providing a final answer based on data, synthesize the result into a clear, full sentence. For example, instead of just "3", say "There are 3 disputes with the category FRAUD."
     7.  Do not just return a dataframe. If the user asks to "list" something, format the output as a clean list or summary.
-    8.  For Date related queries, Today's date is {TODAY}
+    8.  For Date related queries, use today's date as stated at the start of the user's message.
     9.  If you are unsure about the user's request or if it is ambiguous, ask for clarification instead of making assumptions.
 """).strip()
 
 
-def get_agent_executor(df: pd.DataFrame):
+def _schema_summary(df: pd.DataFrame, max_chars: int = 40) -> str:
+    """
+    (Internal) Describes the DataFrame in a few compact lines for the prompt.
+
+    Lists each column with its dtype and one truncated example value. The prompt
+    stays small however many rows or long text columns the frame has.
+    """
+    lines = [f"The DataFrame `df` has {len(df)} rows and these columns:"]
+    for col in df.columns:
+        non_null = df[col].dropna()
+        example = str(non_null.iloc[0]) if len(non_null) else ""
+        if len(example) > max_chars:
+            example = example[:max_chars - 3] + "..."
+        lines.append(f"- `{col}` ({df[col].dtype}), e.g. {example!r}")
+    return "\n".join(lines)
+
+
+@st.cache_resource(show_spinner=False)
+def _build_llm(model: str, google_api_key: str):
+    """
+    (Internal) Builds the Gemini LLM client once per process.
+
+    Streamlit hashes the arguments to form the cache key, so a change of model
+    or API key produces a fresh client.
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # Note: Upgraded to gemini-2.5-flash which is faster and often better for this kind of task.
+    return ChatGoogleGenerativeAI(
+        model=model,
+        google_api_key=google_api_key,
+        temperature=0, # Keep it deterministic for data tasks
+        # Latency knobs: greedy decoding skips sampling work, the output cap stops
+        # runaway verbose answers, and fewer retries bound the worst-case wait.
+        top_k=1,
+        top_p=1.0,
+        max_output_tokens=512,
+        max_retries=2,
+    )
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_agent(_llm, _df: pd.DataFrame, data_sig: tuple):
+    """
+    (Internal) Builds the pandas DataFrame agent once per distinct dataset.
+
+    The LLM and DataFrame are not hashed (leading underscore); the cache is keyed
+    on `data_sig`, a content signature of the DataFrame, so sessions analyzing the
+    same data share one agent and different data can never hit another's entry.
+    At most `max_entries` agents are kept, least recently used evicted first.
+    """
+    from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+    from langchain.agents.agent_types import AgentType
+
+    # Describe the schema compactly instead of embedding a markdown `df.head()`.
+    # The python tool still sees the full DataFrame.
+    prefix = f"{AGENT_PREFIX}\n\n{_schema_summary(_df)}"
+
+    # Create the pandas DataFrame agent with our custom prefix.
+    # Function calling replaces ReAct's free-text "Thought/Action" parsing, which
+    # takes fewer LLM round-trips per question and cannot fail to parse.
+    # The functions agent joins prefix + suffix; without the df preview its default
+    # suffix is None, so an empty suffix must be passed explicitly.
+    return create_pandas_dataframe_agent(
+        llm=_llm,
+        df=_df,
+        agent_type=AgentType.OPENAI_FUNCTIONS,
+        prefix=prefix,
+        suffix="",
+        include_df_in_prompt=False,
+        verbose=False,
+        handle_parsing_errors=False,
+        allow_dangerous_code=True
+    )
+
+
+def get_agent_executor(df: pd.DataFrame, data_sig: tuple):
     """
     Creates and configures a LangChain agent executor for a given DataFrame.
 
     This agent is designed to have a conversational chat with the data,
-    powered by Google's Gemini model and a custom prompt.
+    powered by Google's Gemini model and a custom prompt. Both the LLM client
+    and the agent are cached with `st.cache_resource`, so repeated calls for the
+    same data return the existing executor.
 
     Args:
         df (pd.DataFrame): The unified DataFrame containing all dispute information.
+        data_sig (tuple): A content signature of `df`, used as the agent's cache key.
 
     Returns:
         An agent executor object ready to be invoked.
@@ -55,26 +151,79 @@ def get_agent_executor(df: pd.DataFrame):
         st.error("Google API key not found. Please add it to your Streamlit secrets.")
         st.stop()
         
-    google_api_key = st.secrets["GOOGLE_API_KEY"]
+    llm = _build_llm(MODEL_NAME, st.secrets["GOOGLE_API_KEY"])
+    return _build_agent(llm, df, data_sig)
 
-    # Initialize the Gemini LLM
-    # Note: Upgraded to gemini-2.5-flash which is faster and often better for this kind of task.
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=google_api_key,
-        temperature=0, # Keep it deterministic for data tasks
-        convert_system_message_to_human=True,
-    )
 
-    # Create the pandas DataFrame agent with our custom prefix
-    agent_executor = create_pandas_dataframe_agent(
-        llm=llm,
-        df=df,
-        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        prefix=AGENT_PREFIX,
-        verbose=True,
-        handle_parsing_errors=False,
-        allow_dangerous_code=True
+def _run_config() -> dict:
+    """(Internal) Runnable config shared by all agent calls: concurrency cap plus optional tracing."""
+    callbacks = []
+    if DEBUG_AGENT:
+        from langchain_core.tracers import LangChainTracer
+
+        callbacks.append(LangChainTracer())
+    return {"max_concurrency": AGENT_MAX_CONCURRENCY, "callbacks": callbacks}
+
+
+def _with_history(prompt: str, history: list = None) -> str:
+    """
+    (Internal) Prepends the last `CHAT_HISTORY_WINDOW` chat messages to the prompt.
+
+    The pandas agent's prompt has no chat-history slot, so recent turns are sent
+    as part of the input text.
+    """
+    recent = (history or [])[-CHAT_HISTORY_WINDOW:]
+    if not recent:
+        return prompt
+    turns = "\n".join(
+        f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in recent
     )
+    return f"Recent conversation (most recent last):\n{turns}\n\nCurrent question: {prompt}"
 
-    return agent_executor
\ No newline at end of file
+
+def _agent_input(prompt: str, history: list = None) -> dict:
+    """
+    (Internal) Builds the agent input for one question, stamped with today's date.
+
+    The date is resolved on every call rather than baked into the cached agent's
+    prompt, so a session left open past midnight still gets the right day.
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    return {"input": f"Today's date is {today}.\n\n{_with_history(prompt, history)}"}
+
+
+async def astream_answer(agent_executor, prompt: str, history: list = None):
+    """
+    Asynchronously yields the agent's final answer for a single prompt.
+
+    Uses the executor's async API, so independent actions within a step run
+    concurrently instead of one after another. The result can be passed
+    directly to `st.write_stream`.
+
+    Args:
+        agent_executor: An executor returned by `get_agent_executor`.
+        prompt (str): The user's question.
+        history (list): Earlier chat messages ({"role", "content"} dicts);
+            only the most recent `CHAT_HISTORY_WINDOW` are sent.
+    """
+    config = _run_config()
+    agent_input = _agent_input(prompt, history)
+    async for chunk in agent_executor.astream(agent_input, config=config):
+        if "output" in chunk:
+            yield chunk["output"]
+
+
+def answer_batch(agent_executor, prompts: list) -> list:
+    """
+    Answers several independent prompts concurrently.
+
+    Args:
+        agent_executor: An executor returned by `get_agent_executor`.
+        prompts (list): The user questions to answer.
+
+    Returns:
+        A list of answer strings, in the same order as `prompts`.
+    """
+    config = _run_config()
+    responses = agent_executor.batch([_agent_input(p) for p in prompts], config=config)
+    return [response["output"] for response in responses]
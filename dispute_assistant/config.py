@@ -8,6 +8,15 @@ By centralizing the configuration, we can easily update the logic (e.g., add a n
 without modifying the main application code.
 """
 
+from types import MappingProxyType
+
+# --- Pipeline Versioning ---
+PIPELINE_VERSION = 1
+"""
+Version of the classification pipeline's output. Part of the key of the analysis caches:
+bump it when a change outside config.py and core.py (e.g. a new model release) alters results.
+"""
+
 # --- Fuzzy Matching Configuration ---
 FUZZY_MATCH_THRESHOLD = 85
 """
@@ -15,8 +24,75 @@ The similarity score threshold (out of 100) for fuzzy matching.
 A lower value makes matching more lenient, a higher value makes it stricter.
 """
 
+# --- CSV Schemas ---
+DISPUTES_DTYPES = {
+    "dispute_id": "string[pyarrow]",
+    "customer_id": "string[pyarrow]",
+    "txn_id": "string[pyarrow]",
+    "description": "string[pyarrow]",
+    "txn_type": "string[pyarrow]",
+    "channel": "string[pyarrow]",
+    "amount": "int64[pyarrow]",
+    "created_at": "timestamp[s][pyarrow]",
+}
+"""
+Explicit column types for the disputes CSV, so the pyarrow reader can skip type inference.
+"""
+
+TRANSACTIONS_DTYPES = {
+    "txn_id": "string[pyarrow]",
+    "customer_id": "string[pyarrow]",
+    "amount": "int64[pyarrow]",
+    "status": "string[pyarrow]",
+    "timestamp": "timestamp[s][pyarrow]",
+    "channel": "string[pyarrow]",
+    "merchant": "string[pyarrow]",
+}
+"""
+Explicit column types for the transactions CSV, so the pyarrow reader can skip type inference.
+"""
+
+UPLOADED_DISPUTES_DTYPES = {
+    "dispute_id": "string",
+    "customer_id": "category",
+    "txn_id": "string",
+    "description": "string",
+    "txn_type": "category",
+    "channel": "category",
+}
+"""
+Column types for user-uploaded disputes CSVs. Repetitive labels become `category`; numeric and
+date columns are left to the parser, since uploads are not guaranteed to match the sample schema.
+`description` is pinned to string so a header-only or all-blank column is not inferred as null.
+"""
+
+UPLOADED_TRANSACTIONS_DTYPES = {
+    "txn_id": "string",
+    "customer_id": "category",
+    "status": "category",
+    "channel": "category",
+    "merchant": "category",
+}
+"""
+Column types for user-uploaded transactions CSVs. `amount` is not forced to float32: it cannot
+hold every cent value exactly, and the duplicate check compares amounts for equality.
+"""
+
+# --- Embedding Model Configuration ---
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+"""
+The SentenceTransformer model used for semantic similarity.
+"paraphrase-MiniLM-L3-v2" has half the layers and is roughly twice as fast, at some cost in match quality.
+"""
+
+EMBED_QUANTIZE_INT8 = True
+"""
+Whether to apply dynamic int8 quantization to the model's Linear layers when it runs on CPU.
+Similarity rankings are robust to it, and it cuts the CPU cost of every encode.
+"""
+
 # --- Keyword and Phrase Dictionaries for Classification ---
-KEYWORD_MAP = {
+_KEYWORD_MAP_RAW = {
     "FRAUD": [
         # Single, high-confidence keywords
         "fraud", "unauthorized", "suspicious", "chargeback",
@@ -36,13 +112,19 @@ KEYWORD_MAP = {
         "transaction declined", "gateway failed"
     ]
 }
+
+KEYWORD_MAP = MappingProxyType({
+    category: tuple(phrase.lower() for phrase in phrases)
+    for category, phrases in _KEYWORD_MAP_RAW.items()
+})
 """
-A dictionary mapping dispute categories to a list of "evidence patterns".
+A read-only mapping of dispute categories to a tuple of "evidence patterns".
 The fuzzy matching logic will compare dispute descriptions against these patterns.
+Phrases are lowercased once here, so the classifier never re-normalizes them.
 """
 
 # --- Resolution Suggestion Mapping ---
-RESOLUTION_MAP = {
+_RESOLUTION_MAP_RAW = {
     "DUPLICATE_CHARGE": {
         "action": "Auto-refund",
         "justification": "High confidence duplicate transaction pattern detected."
@@ -65,7 +147,10 @@ RESOLUTION_MAP = {
     }
 }
 
+RESOLUTION_MAP = MappingProxyType({
+    category: MappingProxyType(info) for category, info in _RESOLUTION_MAP_RAW.items()
+})
 """
-A dictionary mapping a predicted category to a suggested action and a base justification template.
+A read-only mapping of a predicted category to a suggested action and a base justification template.
 The final justification will be a combination of this template and the dynamic explanation from the classifier.
 """
\ No newline at end of file
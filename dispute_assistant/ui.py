@@ -12,6 +12,18 @@ import streamlit as st
 import pandas as pd
 
 
+SESSION_DEFAULTS = {
+    'classified_df': None,
+    'resolutions_df': None,
+    'unified_df': None,
+    'agent_executor': None,
+    'agent_sig': None,
+    'messages': [{"role": "assistant", "content": "How can I help you with the dispute data?"}],
+    'active_view': "Analysis",
+}
+"""Initial values for every session-state key the app reads, applied once per session."""
+
+
 def build_sidebar():
     """
     Creates the sidebar UI for both uploading custom files and loading sample data.
@@ -54,13 +66,25 @@ def build_sidebar():
     return disputes_file, transactions_file, process_upload_clicked, process_sample_clicked
 
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def _df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """(Internal) Serializes a results table for download, cached on its content across reruns."""
+    return df.to_csv().encode('utf-8')
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _category_counts(categories: pd.Series) -> pd.Series:
+    """(Internal) Counts disputes per predicted category for the trends chart."""
+    return categories.value_counts()
+
+
 def display_results(classified_df, resolutions_df):
     """
     Displays the processed results on the main page of the Streamlit app.
 
     Args:
-        classified_df (pd.DataFrame): The DataFrame with classified disputes.
-        resolutions_df (pd.DataFrame): The DataFrame with suggested resolutions.
+        classified_df (pd.DataFrame): The DataFrame with classified disputes, indexed by dispute_id.
+        resolutions_df (pd.DataFrame): The DataFrame with suggested resolutions, indexed by dispute_id.
     """
     st.header("Analysis Results")
     st.success("Processing complete. The tables below show the classification and resolution suggestions.")
@@ -80,8 +104,9 @@ def display_results(classified_df, resolutions_df):
                 required=True,
             )
         },
-        disabled=["dispute_id", "predicted_category", "confidence", "explanation"],
-        hide_index=True,
+        # dispute_id is the index, shown as the first (read-only) column
+        disabled=["_index", "predicted_category", "confidence", "explanation"],
+        hide_index=False,
         use_container_width=True
     )
     
@@ -90,7 +115,7 @@ def display_results(classified_df, resolutions_df):
 
     st.download_button(
         label="Download Classified Disputes as CSV",
-        data=edited_df.to_csv(index=False).encode('utf-8'),
+        data=_df_to_csv_bytes(edited_df),
         file_name='classified_disputes.csv',
         mime='text/csv',
     )
@@ -99,10 +124,10 @@ def display_results(classified_df, resolutions_df):
 
     # --- Display Resolution Suggestions ---
     st.subheader("Resolution Suggestions")
-    st.dataframe(resolutions_df, hide_index=True, use_container_width=True)
+    st.dataframe(resolutions_df, hide_index=False, use_container_width=True)
     st.download_button(
         label="Download Resolutions as CSV",
-        data=resolutions_df.to_csv(index=False).encode('utf-8'),
+        data=_df_to_csv_bytes(resolutions_df),
         file_name='resolutions.csv',
         mime='text/csv',
     )
@@ -111,7 +136,7 @@ def display_results(classified_df, resolutions_df):
 
     # --- Display Dispute Trends Visualization (Bonus) ---
     st.subheader("Dispute Trends")
-    category_counts = edited_df['predicted_category'].value_counts()
+    category_counts = _category_counts(edited_df['predicted_category'])
     st.bar_chart(category_counts)
 
 
@@ -127,12 +152,6 @@ def build_chat_interface():
     The assistant is aware of the conversation history.
     """)
 
-    # Initialize chat history in session state if it doesn't exist
-    if "messages" not in st.session_state:
-        st.session_state.messages = [
-            {"role": "assistant", "content": "How can I help you with the dispute data?"}
-        ]
-
     # Display prior chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):